@@ -1,13 +1,32 @@
 import argparse
+import asyncio
+import os
 import sys
 import socket
 import logging
 import signal
-import xml.etree.ElementTree as ET
-from .core import LumixCamera
+from .core import LumixCamera, ET
 
 logger = logging.getLogger(__name__)
 
+def xml_to_string(elem, pretty=False):
+    # Serialize with whichever XML backend parsed the element; indent() also
+    # replaces the whitespace the camera puts between elements
+    if pretty and hasattr(ET, 'indent'):
+        ET.indent(elem)
+    return ET.tostring(elem, encoding='unicode')
+
+def write_all(fd, data):
+    # Unbuffered writes may be partial (e.g. on an interrupted pipe)
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+async def preview(camera, port, output):
+    async for data in camera.stream_preview_async(port=port):
+        if output:
+            write_all(output.fileno(), data)
+
 def main():
     parser = argparse.ArgumentParser(description="Control Panasonic Lumix Camera")
     parser.add_argument('--host', default='192.168.54.1', help='Camera IP address')
@@ -40,6 +59,7 @@ def main():
     dl_parser = subparsers.add_parser('download', help='Download a file')
     dl_parser.add_argument('file', help='File path on camera (e.g. /DL1000001.JPG)')
     dl_parser.add_argument('--dest', help='Destination filename')
+    dl_parser.add_argument('--resume', action='store_true', help='Skip existing files and resume interrupted downloads')
 
     # Browse/List
     ls_parser = subparsers.add_parser('ls', help='List files on camera')
@@ -57,14 +77,7 @@ def main():
                 state = camera.get_content_info()
             else:
                 state = camera.get_state()
-            # Basic printing of XML content recursively
-            def print_elem(elem, level=0):
-                indent = "  " * level
-                text = elem.text.strip() if elem.text else ""
-                print(f"{indent}{elem.tag}: {text}")
-                for child in elem:
-                    print_elem(child, level + 1)
-            print_elem(state)
+            print(xml_to_string(state, pretty=True).rstrip("\n"))
         except Exception as e:
             print(f"Error getting info: {e}", file=sys.stderr)
 
@@ -76,18 +89,18 @@ def main():
             print(f"Starting preview stream on UDP {udp_port}...", file=sys.stderr)
             print("Press Ctrl+C to stop.", file=sys.stderr)
             
-            output = sys.stdout.buffer if args.stdout else None
-            
+            # Unbuffered outputs, so every packet reaches the consumer immediately
+            output = None
+            if args.stdout:
+                output = os.fdopen(sys.stdout.fileno(), 'wb', buffering=0, closefd=False)
+
             if args.out:
-                output = open(args.out, 'wb')
+                output = open(args.out, 'wb', buffering=0)
             
             if not output and not args.stdout:
                  print("Receiving stream but not saving/displaying (use --stdout or --out)...", file=sys.stderr)
 
-            for data in camera.stream_preview(port=udp_port):
-                if output:
-                    output.write(data)
-                    output.flush()
+            asyncio.run(preview(camera, udp_port, output))
 
         except KeyboardInterrupt:
             print("\nStopping preview...", file=sys.stderr)
@@ -105,7 +118,7 @@ def main():
             if result is not None:
                 print(f"Result: {result.text}")
             else:
-                print(ET.tostring(res, encoding='unicode'))
+                print(xml_to_string(res))
         else:
             print(f"Getting {args.setting}", file=sys.stderr)
             res = camera.get_setting(args.setting)
@@ -117,7 +130,7 @@ def main():
                     print(val.text)
                 else:
                     # Just dump XML structure if value not found directly
-                     print(ET.tostring(res, encoding='unicode'))
+                     print(xml_to_string(res))
 
     elif args.command == 'image':
         if args.preview:
@@ -151,7 +164,7 @@ def main():
 
     elif args.command == 'download':
         print(f"Downloading {args.file}...", file=sys.stderr)
-        local_file = camera.download_file(args.file, args.dest)
+        local_file = camera.download_file(args.file, args.dest, resume=args.resume)
         if local_file:
             print(f"Downloaded to {local_file}")
         else:
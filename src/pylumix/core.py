@@ -1,13 +1,87 @@
+import asyncio
 import requests
+from requests.adapters import HTTPAdapter
 import time
 import socket
-import xml.etree.ElementTree as ET
+import selectors
+import threading
 from urllib.parse import urljoin
 import os
+import shutil
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+try:
+    from lxml import etree as ET
+
+    HAS_LXML = True
+except ImportError:  # pragma: no cover - lxml is optional
+    import xml.etree.ElementTree as ET
+
+    HAS_LXML = False
 
 logger = logging.getLogger(__name__)
 
+if HAS_LXML:
+    # Compiled once, used on every state poll
+    _XP_SD_ACCESS = ET.XPath("string(.//sd_access)")
+
+# UPnP ContentDirectory Browse request, pre-encoded so only the arguments are formatted per call
+_BROWSE_HEADERS = {
+    "Content-Type": 'text/xml; charset="utf-8"',
+    "SOAPAction": '"urn:schemas-upnp-org:service:ContentDirectory:1#Browse"',
+    "User-Agent": "Panasonic Android/1 DM-CP",
+}
+_BROWSE_SOAP_TMPL = b"""<?xml version="1.0" encoding="utf-8"?>
+<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
+ <s:Body>
+  <u:Browse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1" xmlns:pana="urn:schemas-panasonic-com:pana">
+   <ObjectID>%b</ObjectID>
+   <BrowseFlag>BrowseDirectChildren</BrowseFlag>
+   <Filter>*</Filter>
+   <StartingIndex>%d</StartingIndex>
+   <RequestedCount>%d</RequestedCount>
+   <SortCriteria></SortCriteria>
+   <pana:X_FromCP>LumixLink2.0</pana:X_FromCP>
+  </u:Browse>
+ </s:Body>
+</s:Envelope>"""
+
+# Seconds for which a successful access check is trusted
+ACCESS_TTL = 30.0
+
+# Chunk size used when streaming downloads to disk
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+
+# Receive buffer for the preview socket, large enough to absorb bursts of fragments
+PREVIEW_RCVBUF = 2_500_000
+
+
+class _CameraHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter whose sockets disable Nagle's algorithm and enable TCP keep-alive."""
+
+    socket_options = [
+        (socket.IPPROTO_TCP, socket.TCP_NODELAY, 1),
+        (socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1),
+    ]
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["socket_options"] = self.socket_options
+        super().init_poolmanager(*args, **kwargs)
+
+
+class _PreviewProtocol(asyncio.DatagramProtocol):
+    """Push received preview datagrams into a bounded queue, dropping the oldest when full."""
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def datagram_received(self, data, addr):
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(data)
+
 
 class LumixCamera:
     def __init__(self, host="192.168.54.1"):
@@ -18,12 +92,35 @@ class LumixCamera:
         # Default session ID and device info
         self.device_id = "4D454930-0100-1000-8001-020A0003BD13"
         self.device_name = "pylumix"
+        # Last mode ("recmode" or "playmode") confirmed by the camera, None if unknown
+        self._mode = None
+        # Access is not re-checked within ACCESS_TTL seconds of a successful check
+        self._access_ok_until = 0.0
+        # Keep-alive session shared by all requests to the camera
+        self.session = requests.Session()
+        self.session.headers["Connection"] = "keep-alive"
+        adapter = _CameraHTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0)
+        self.session.mount("http://", adapter)
+        # Reuse parsers when lxml is available, with a lean one for frequent state polls
+        if HAS_LXML:
+            self._parser = ET.XMLParser(huge_tree=False, resolve_entities=False)
+            self._state_parser = ET.XMLParser(
+                collect_ids=False, remove_blank_text=True, resolve_entities=False
+            )
+        else:
+            self._parser = None
+            self._state_parser = None
 
     def _request(self, mode, **kwargs):
         params = {"mode": mode}
         params.update(kwargs)
-        response = requests.get(self.base_url, params=params, timeout=5)
-        response.raise_for_status()
+        try:
+            response = self.session.get(self.base_url, params=params, timeout=5)
+            response.raise_for_status()
+        except requests.RequestException:
+            # Connection lost or request rejected; re-check access on the next ensure_access()
+            self._access_ok_until = 0.0
+            raise
         return response
 
     def cam_cmd(self, value, value2=None):
@@ -32,13 +129,36 @@ class LumixCamera:
         if value2:
             kwargs["value2"] = value2
         resp = self._request("camcmd", **kwargs)
-        return self._parse_xml(resp.text)
-
-    def _parse_xml(self, content):
+        if value in ("recmode", "playmode", "capture"):
+            # The mode is only known again once _ensure_mode() confirms a switch;
+            # the camera may also change modes on its own after a capture
+            self._mode = None
+        return self._parse_xml(resp.content)
+
+    def _ensure_mode(self, mode):
+        """Switch to mode ("recmode" or "playmode") unless the camera is already in it."""
+        if self._mode == mode:
+            return
+        result = self.cam_cmd(mode).find("result")
+        if result is None or (result.text or "").strip() != "ok":
+            return
+        if mode == "playmode" and not self._wait_for_mode("play"):
+            return
+        self._mode = mode
+
+    def reset_mode(self):
+        """Forget the cached camera mode, e.g. after the mode was changed on the camera itself."""
+        self._mode = None
+
+    def _parse_xml(self, content, parser=None):
+        # Parse raw response bytes, letting the parser honour the XML encoding declaration
         try:
-            return ET.fromstring(content)
+            root = ET.fromstring(content, parser or self._parser)
         except ET.ParseError as e:
             raise RuntimeError(f"Failed to parse XML response: {e}, content: {content}")
+        if root is None:
+            raise RuntimeError(f"Failed to parse XML response, content: {content}")
+        return root
 
     def req_acc(self) -> bool:
         """Request access / pairing."""
@@ -51,15 +171,16 @@ class LumixCamera:
         return True
 
     def ensure_access(self):
+        if time.time() < self._access_ok_until:
+            return True
+
         # Check for access rejection and try to request access
         state = self.get_state()
         # The XML root is usually <camrply>, so we look for 'result' direct child
         result = state.find("result")
 
-        if result is not None and (result.text or "").strip() == "ok":
-            return True
-
-        if self.req_acc():
+        if (result is not None and (result.text or "").strip() == "ok") or self.req_acc():
+            self._access_ok_until = time.time() + ACCESS_TTL
             return True
 
         raise RuntimeError("Access request failed. Check connection.")
@@ -67,37 +188,64 @@ class LumixCamera:
     def get_state(self):
         """Get camera state (heartbeat)."""
         resp = self._request("getstate")
-        return self._parse_xml(resp.text)
+        return self._parse_xml(resp.content)
     
+    def _wait_for_mode(self, expected, timeout=2.0, interval=0.05) -> bool:
+        """Poll the camera state until cammode reports the expected mode ("rec" or "play").
+        Returns False if the mode did not switch within timeout seconds.
+        """
+        end_time = time.time() + timeout
+        while time.time() < end_time:
+            try:
+                node = self.get_state().find(".//cammode")
+            except (requests.RequestException, RuntimeError):
+                node = None
+            if node is not None and (node.text or "").strip() == expected:
+                return True
+            time.sleep(interval)
+        logger.debug(f"Timeout waiting for camera mode {expected!r}")
+        return False
+
     def sd_access(self) -> bool:
-        state = self.get_state()
+        resp = self._request("getstate")
+        state = self._parse_xml(resp.content, self._state_parser)
+        if HAS_LXML:
+            return _XP_SD_ACCESS(state) == 'on'
         node = state.find(".//sd_access")
         return node is not None and (node.text or "") == 'on'
 
-    def capture(self, timeout: float = 10.0, poll_interval: float = 0.2) -> bool:
-        """Trigger capture and wait until total_content_number increases by one.
-        Polls every poll_interval seconds (default 0.3s) up to timeout seconds.
+    def capture(
+        self,
+        timeout: float = 10.0,
+        poll_interval: float = 0.05,
+        max_poll_interval: float = 0.5,
+    ) -> bool:
+        """Trigger capture and wait until the camera has finished writing to the SD card.
+        Polls sd_access starting every poll_interval seconds (default 0.05s), backing off
+        up to max_poll_interval seconds (default 0.5s), for at most timeout seconds.
         Returns True on success, raises RuntimeError on failure/timeout.
         """
-        self.cam_cmd("recmode")
+        self._ensure_mode("recmode")
 
         # Trigger capture
         self.cam_cmd("capture")
 
         sd_used = False
+        interval = poll_interval
         end_time = time.time() + timeout
         while time.time() < end_time:
             sd_access = self.sd_access()
             if not sd_access and sd_used:
                 return True
             sd_used = sd_used or sd_access
-            time.sleep(poll_interval)
+            time.sleep(interval)
+            interval = min(interval * 1.5, max_poll_interval)
 
         # return False
         raise RuntimeError("Timeout waiting for image")
 
     def video_recstart(self):
-        self.cam_cmd("recmode")
+        self._ensure_mode("recmode")
         return self.cam_cmd("video_recstart")
 
     def video_recstop(self):
@@ -106,73 +254,144 @@ class LumixCamera:
     def get_setting(self, setting_type):
         """Get a specific setting."""
         resp = self._request("getsetting", type=setting_type)
-        return self._parse_xml(resp.text)
+        return self._parse_xml(resp.content)
 
     def set_setting(self, setting_type, value):
         """Set a specific setting."""
         resp = self._request("setsetting", type=setting_type, value=value)
-        return self._parse_xml(resp.text)
+        return self._parse_xml(resp.content)
 
     def start_stream(self, port):
         """Start streaming to the specified UDP port."""
         # Switch to rec mode first
-        self.cam_cmd("recmode")
+        self._ensure_mode("recmode")
         resp = self._request("startstream", value=port)
-        return self._parse_xml(resp.text)
+        return self._parse_xml(resp.content)
 
     def stop_stream(self):
         resp = self._request("stopstream")
-        return self._parse_xml(resp.text)
+        return self._parse_xml(resp.content)
 
-    def stream_preview(self, port=49152):
-        """Generator that yields UDP packets from the preview stream."""
-        self.cam_cmd("recmode")
+    def _open_preview_socket(self, port):
+        """Bind a UDP socket for the preview stream with an enlarged receive buffer."""
         sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, "SO_REUSEPORT"):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, PREVIEW_RCVBUF)
         try:
             sock.bind(('0.0.0.0', port))
         except OSError as e:
+            sock.close()
             raise RuntimeError(f"Error binding to port {port}: {e}")
+        return sock
 
-        sock.settimeout(2.0)
+    def stream_preview(self, port=49152, heartbeat_interval=2.0):
+        """Generator that yields UDP packets from the preview stream."""
+        self._ensure_mode("recmode")
+        sock = self._open_preview_socket(port)
+        sock.setblocking(False)
+        selector = selectors.DefaultSelector()
+        selector.register(sock, selectors.EVENT_READ)
+        last_heartbeat = time.time()
 
         try:
             self.start_stream(port)
             while True:
-                try:
-                    data, _ = sock.recvfrom(65536)
+                if selector.select(timeout=0.5):
+                    try:
+                        data, _ = sock.recvfrom(65536)
+                    except BlockingIOError:
+                        continue
                     yield data
-                except socket.timeout:
-                    # Send heartbeat to keep stream alive
-                    self.get_state()
+                elif time.time() - last_heartbeat >= heartbeat_interval:
+                    # Send heartbeat to keep stream alive, off the receive path
+                    threading.Thread(target=self._send_heartbeat, daemon=True).start()
+                    last_heartbeat = time.time()
         finally:
             try:
                 self.stop_stream()
             except Exception:
                 pass
+            selector.close()
             sock.close()
 
+    async def stream_preview_async(self, port=49152, heartbeat_interval=2.0):
+        """Async generator that yields UDP packets from the preview stream.
+        Blocking camera requests run in the default executor so receiving never stalls.
+        """
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._ensure_mode, "recmode")
+        sock = self._open_preview_socket(port)
+
+        queue = asyncio.Queue(maxsize=256)
+        transport, _ = await loop.create_datagram_endpoint(
+            lambda: _PreviewProtocol(queue), sock=sock
+        )
+        heartbeat = None
+
+        try:
+            await loop.run_in_executor(None, self.start_stream, port)
+            heartbeat = asyncio.ensure_future(self._heartbeat_loop(heartbeat_interval))
+            while True:
+                yield await queue.get()
+        finally:
+            if heartbeat is not None:
+                heartbeat.cancel()
+            transport.close()
+            try:
+                await loop.run_in_executor(None, self.stop_stream)
+            except Exception:
+                pass
+
+    async def _heartbeat_loop(self, interval):
+        """Periodically send a heartbeat to keep the preview stream alive."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            await loop.run_in_executor(None, self._send_heartbeat)
+
+    def _send_heartbeat(self):
+        try:
+            self.get_state()
+        except Exception as e:
+            logger.warning(f"Heartbeat failed: {e}")
+
     def get_preview_image(self, port=49152):
-        """Capture a single JPEG frame from the preview stream."""
+        """Capture a single JPEG frame from the preview stream.
+        A frame may span several datagrams, so packets are accumulated from SOI up to EOI.
+        """
+        frame = bytearray()
         for data in self.stream_preview(port):
-            # Simple check for JPEG in this packet (SOI ... EOI)
-            start = data.find(b'\xff\xd8')
-            end = data.find(b'\xff\xd9')
-
-            if start != -1 and end != -1 and end > start:
-                return data[start : end + 2]
+            if not frame:
+                start = data.find(b'\xff\xd8')
+                if start == -1:
+                    continue
+                frame += memoryview(data)[start:]
+                search_from = 2
+            else:
+                # Only scan the new tail (plus one byte for a split marker)
+                search_from = len(frame) - 1
+                frame += data
+
+            end = frame.find(b'\xff\xd9', search_from)
+            if end != -1:
+                return bytes(frame[: end + 2])
         return None
 
     def get_content_info(self):
-        self.cam_cmd("playmode")
-        # Wait a bit for the mode switch
-        time.sleep(1.0)
+        self._ensure_mode("playmode")
+        return self._get_content_info()
+
+    def _get_content_info(self):
+        """get_content_info() without the play mode switch."""
         resp = self._request("get_content_info")
-        return self._parse_xml(resp.text)
-    
+        return self._parse_xml(resp.content)
 
     def total_content_number(self) -> int:
-        root = self.get_content_info()
+        return self._total_content_number(self.get_content_info())
+
+    def _total_content_number(self, root) -> int:
         node = root.find("total_content_number")
         if node is None or (node.text or "").strip() == "":
             raise RuntimeError("total_content_number not found in response")
@@ -181,8 +400,11 @@ class LumixCamera:
         except ValueError:
             raise RuntimeError(f"Invalid total_content_number value: {node.text!r}")
 
-    def download_file(self, filename, local_filename=None): 
-        """Download a file from the camera."""
+    def download_file(self, filename, local_filename=None, resume=False):
+        """Download a file from the camera.
+        Data is written to local_filename + ".part" and renamed once complete. With resume=True
+        an existing local file is kept and an interrupted .part download is continued.
+        """
         # Filename should be like /DL1000001.JPG
         # Ensure generic path construction if only ID provided?
         # For now assume full path from camera listing or constructed by user.
@@ -192,27 +414,80 @@ class LumixCamera:
         )  # lstrip to ensure relative to base
         if not local_filename:
             local_filename = os.path.basename(filename)
+        part_filename = local_filename + ".part"
+        # ETag / Last-Modified of the partial download, sent back as If-Range
+        validator_filename = part_filename + ".validator"
 
         try:
-            with requests.get(url, stream=True, timeout=120) as r:
+            if resume and os.path.exists(local_filename):
+                return local_filename
+
+            headers = {}
+            if resume and os.path.exists(part_filename):
+                offset = os.path.getsize(part_filename)
+                if offset:
+                    headers["Range"] = f"bytes={offset}-"
+                    if os.path.exists(validator_filename):
+                        with open(validator_filename) as f:
+                            headers["If-Range"] = f.read()
+
+            with self.session.get(url, stream=True, timeout=120, headers=headers) as r:
                 r.raise_for_status()
-                with open(local_filename, "wb") as f:
-                    for chunk in r.iter_content(chunk_size=8192):
-                        f.write(chunk)
+                r.raw.decode_content = True
+                # Only append if the camera actually honoured the range request
+                if r.status_code == 206:
+                    mode = "ab"
+                else:
+                    mode = "wb"
+                    self._save_validator(r, validator_filename)
+                with open(part_filename, mode) as f:
+                    shutil.copyfileobj(r.raw, f, length=DOWNLOAD_CHUNK_SIZE)
+            os.replace(part_filename, local_filename)
+            if os.path.exists(validator_filename):
+                os.remove(validator_filename)
             return local_filename
         except Exception as e:
             print(f"Failed to download {url}: {e}")
             return None
 
+    def _save_validator(self, response, validator_filename):
+        """Store the response's strong ETag or Last-Modified for a later If-Range."""
+        etag = response.headers.get("ETag")
+        if etag and etag.startswith("W/"):
+            # Weak ETags are not allowed in If-Range
+            etag = None
+        validator = etag or response.headers.get("Last-Modified")
+        if validator:
+            with open(validator_filename, "w") as f:
+                f.write(validator)
+        elif os.path.exists(validator_filename):
+            os.remove(validator_filename)
+
+    def download_many(self, filenames, dest_dir=".", max_workers=4, resume=False):
+        """Download several files in parallel into dest_dir.
+        Returns the local filenames in input order (None for failed downloads).
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+
+        def download(filename):
+            return self.download_file(
+                filename, os.path.join(dest_dir, os.path.basename(filename)), resume
+            )
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(download, filenames))
+
     def get_latest_item(self):
         """Get the most recently added item info."""
         try:
+            # Switch to play mode once for both requests
+            self._ensure_mode("playmode")
             # We need total count to find the index of the last item
-            total = self.total_content_number()
+            total = self._total_content_number(self._get_content_info())
             if total > 0:
                 # Browse requesting 1 item at proper index (0-based)
                 # Assumes content is appended at the end
-                items = self.browse(start_index=total - 1, count=1)
+                items = self._browse(start_index=total - 1, count=1)
                 if items:
                     return items[0]
         except Exception as e:
@@ -223,7 +498,7 @@ class LumixCamera:
         """Download a file into memory."""
         url = urljoin(self.binary_base_url, filename.lstrip("/"))
         try:
-            with requests.get(url, timeout=30) as r:
+            with self.session.get(url, timeout=30) as r:
                 r.raise_for_status()
                 return r.content
         except Exception as e:
@@ -232,70 +507,68 @@ class LumixCamera:
 
     def browse(self, object_id="0", start_index=0, count=15):
         """Browse content using UPnP ContentDirectory service."""
-        self.cam_cmd("playmode")
-        time.sleep(1)
-
-        soap_action = '"urn:schemas-upnp-org:service:ContentDirectory:1#Browse"'
-        headers = {
-            "Content-Type": 'text/xml; charset="utf-8"',
-            "SOAPAction": soap_action,
-            "User-Agent": "Panasonic Android/1 DM-CP",
-        }
-
-        body = f"""<?xml version="1.0" encoding="utf-8"?>
-<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
- <s:Body>
-  <u:Browse xmlns:u="urn:schemas-upnp-org:service:ContentDirectory:1" xmlns:pana="urn:schemas-panasonic-com:pana">
-   <ObjectID>{object_id}</ObjectID>
-   <BrowseFlag>BrowseDirectChildren</BrowseFlag>
-   <Filter>*</Filter>
-   <StartingIndex>{start_index}</StartingIndex>
-   <RequestedCount>{count}</RequestedCount>
-   <SortCriteria></SortCriteria>
-   <pana:X_FromCP>LumixLink2.0</pana:X_FromCP>
-  </u:Browse>
- </s:Body>
-</s:Envelope>"""
+        self._ensure_mode("playmode")
+        return self._browse(object_id, start_index, count)
 
+    def _browse(self, object_id="0", start_index=0, count=15):
+        """browse() without the play mode switch."""
         try:
-            resp = requests.post(self.soap_url, data=body, headers=headers, timeout=30)
+            body = _BROWSE_SOAP_TMPL % (
+                str(object_id).encode("utf-8"), int(start_index), int(count)
+            )
+            resp = self.session.post(
+                self.soap_url, data=body, headers=_BROWSE_HEADERS, timeout=30
+            )
             resp.raise_for_status()
 
-            root = ET.fromstring(resp.text)
-
-            # Helper to find Result recursively regardless of namespace
-            result_node = None
-            for elem in root.iter():
-                if "Result" in elem.tag:
-                    result_node = elem
-                    break
+            root = self._parse_xml(resp.content)
+            result_node = self._find_result(root)
 
             items_list = []
             if result_node is not None and result_node.text:
-                didl_xml = result_node.text
-                didl_root = ET.fromstring(didl_xml)
-
-                for item in didl_root.iter():
-                    if "item" in item.tag:
-                        # Extract URL from res
-                        res_url = None
-                        for child in item:
-                            if "res" in child.tag:
-                                res_url = child.text
-                                break
-
-                        # Extract title
-                        title = None
-                        for child in item:
-                            if "title" in child.tag:
-                                title = child.text
-                                break
-
-                        items_list.append(
-                            {"id": item.get("id"), "title": title, "url": res_url}
-                        )
+                for item in self._iter_didl_items(result_node.text):
+                    res_url, title = self._item_fields(item)
+                    items_list.append(
+                        {"id": item.get("id"), "title": title, "url": res_url}
+                    )
             return items_list
 
         except Exception as e:
             print(f"Browse failed: {e}")
             return []
+
+    def _find_result(self, root):
+        """Find the <Result> node of a SOAP response regardless of namespace."""
+        return root.find(".//{*}Result")
+
+    def _iter_didl_items(self, didl_xml):
+        """Incrementally parse a DIDL-Lite document, yielding each <item>.
+        Items are cleared once consumed so the full tree is never kept in memory.
+        """
+        source = BytesIO(didl_xml.encode("utf-8"))
+        if HAS_LXML:
+            context = ET.iterparse(
+                source, events=("end",), tag="{*}item", recover=True, resolve_entities=False
+            )
+        else:
+            context = (
+                (event, elem)
+                for event, elem in ET.iterparse(source, events=("end",))
+                if elem.tag.rpartition("}")[2] == "item"
+            )
+        for _, item in context:
+            yield item
+            item.clear()
+            if HAS_LXML:
+                # Drop already processed siblings as well
+                while item.getprevious() is not None:
+                    del item.getparent()[0]
+
+    def _item_fields(self, item):
+        """Return the (url, title) pair of a DIDL-Lite <item>."""
+        res = item.find("{*}res")
+        title = item.find("{*}title")
+        return (
+            res.text if res is not None else None,
+            title.text if title is not None else None,
+        )